@@ -0,0 +1,105 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Optional, Callable, Tuple
+
+CLIENT_ASSERTION_TYPE = 'urn:ietf:params:oauth:client-assertion-type:jwt-bearer'
+
+
+def _base64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+class ClientAssertion(ABC):
+    """
+    Builds JWT client assertions (RFC 7523) used to authenticate the client on the token endpoint.
+    By default each token request gets a new assertion with its own ``jti``, as most servers reject replayed ones.
+    For servers accepting them, a higher ``max_uses`` (or None for no limit) keeps a signed assertion and serves it
+    again until it comes within ``reuse_margin`` seconds of its expiration or has been used ``max_uses`` times.
+    """
+
+    def __init__(self, algorithm: str, lifetime: int = 300, reuse_margin: int = 30,
+                 max_uses: Optional[int] = 1, key_id: Optional[str] = None):
+        if lifetime <= reuse_margin:
+            raise ValueError('lifetime (%d) must be greater than reuse_margin (%d)' % (lifetime, reuse_margin))
+        if max_uses is not None and max_uses < 1:
+            raise ValueError('max_uses must be at least 1')
+        self.algorithm = algorithm
+        self.lifetime = lifetime
+        self.reuse_margin = reuse_margin
+        self.max_uses = max_uses
+        self.key_id = key_id
+        self._lock = Lock()
+        self._cache = dict()
+
+    def get(self, client_id: str, audience: str) -> str:
+        return self.issue(client_id, audience)[0]
+
+    def issue(self, client_id: str, audience: str) -> Tuple[str, bool]:
+        """Returns an assertion for ``audience`` and whether it was already served before."""
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get((client_id, audience))
+            if cached is not None:
+                assertion, expires_at, uses = cached
+                if now < expires_at - self.reuse_margin and (self.max_uses is None or uses < self.max_uses):
+                    self._cache[(client_id, audience)] = (assertion, expires_at, uses + 1)
+                    return assertion, True
+            assertion, expires_at = self._build(client_id, audience, now)
+            self._cache[(client_id, audience)] = (assertion, expires_at, 1)
+            return assertion, False
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _build(self, client_id: str, audience: str, now: float) -> Tuple[str, int]:
+        issued_at = int(now)
+        expires_at = issued_at + self.lifetime
+        header = dict(alg=self.algorithm, typ='JWT')
+        if self.key_id is not None:
+            header['kid'] = self.key_id
+        claims = dict(iss=client_id, sub=client_id, aud=audience, jti=str(uuid.uuid4()),
+                      iat=issued_at, exp=expires_at)
+        signing_input = '%s.%s' % (_base64url(json.dumps(header, separators=(',', ':')).encode('UTF-8')),
+                                   _base64url(json.dumps(claims, separators=(',', ':')).encode('UTF-8')))
+        signature = self._sign(signing_input.encode('ascii'))
+        return '%s.%s' % (signing_input, _base64url(signature)), expires_at
+
+    @abstractmethod
+    def _sign(self, signing_input: bytes) -> bytes:
+        pass
+
+
+class ClientSecretJwt(ClientAssertion):
+    """client_secret_jwt authentication: the assertion is signed with HMAC using the client secret."""
+    _DIGESTS = dict(HS256=hashlib.sha256, HS384=hashlib.sha384, HS512=hashlib.sha512)
+
+    def __init__(self, client_secret: str, algorithm: str = 'HS256', **kwargs):
+        if algorithm not in ClientSecretJwt._DIGESTS:
+            raise ValueError('Unsupported algorithm for client_secret_jwt: %s' % algorithm)
+        super(ClientSecretJwt, self).__init__(algorithm, **kwargs)
+        self._key = client_secret.encode('UTF-8')
+        self._digest = ClientSecretJwt._DIGESTS[algorithm]
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        return hmac.new(self._key, signing_input, self._digest).digest()
+
+
+class PrivateKeyJwt(ClientAssertion):
+    """
+    private_key_jwt authentication: ``signer`` receives the JWS signing input and returns the raw signature
+    computed with the client private key for ``algorithm`` (RS256, ES256...).
+    """
+
+    def __init__(self, signer: Callable[[bytes], bytes], algorithm: str = 'RS256', **kwargs):
+        super(PrivateKeyJwt, self).__init__(algorithm, **kwargs)
+        self._signer = signer
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        return self._signer(signing_input)
@@ -0,0 +1,120 @@
+import logging
+import os
+import weakref
+from threading import RLock
+from typing import Optional, Union
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+_logger = logging.getLogger(__name__)
+
+_registries = weakref.WeakSet()
+_transport_pids = weakref.WeakKeyDictionary()
+
+
+class ConnectionPoolRegistry(object):
+    """
+    Shares ``requests`` transport adapters between credential managers. Adapters are keyed by proxies and verify
+    settings, and each adapter keeps one connection pool per host. Managers hold a reference on the adapter they use;
+    the adapter and its pools are closed when the last reference is released. In a forked child, adapters are replaced
+    by new ones so that the child never uses the sockets of its parent.
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 10, max_retries: int = 0):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self._adapters = dict()
+        # reentrant: the garbage collector may run a manager finalizer, hence release, while the lock is held
+        self._lock = RLock()
+        self._pid = os.getpid()
+        _registries.add(self)
+
+    @staticmethod
+    def key(proxies: Optional[dict], verify: Union[bool, str]) -> tuple:
+        return tuple(sorted((proxies or dict()).items())), verify
+
+    def acquire(self, key: tuple) -> HTTPAdapter:
+        self._check_fork()
+        with self._lock:
+            entry = self._adapters.get(key)
+            if entry is None:
+                _logger.debug('acquire - new adapter for %s', str(key))
+                entry = [self._new_adapter(), 0]
+                self._adapters[key] = entry
+            entry[1] += 1
+            return entry[0]
+
+    def adapter(self, key: tuple) -> Optional[HTTPAdapter]:
+        self._check_fork()
+        with self._lock:
+            entry = self._adapters.get(key)
+            return entry[0] if entry is not None else None
+
+    def release(self, key: tuple):
+        self._check_fork()
+        with self._lock:
+            entry = self._adapters.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._adapters[key]
+        _logger.debug('release - closing adapter for %s', str(key))
+        entry[0].close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._adapters)
+
+    def _new_adapter(self) -> HTTPAdapter:
+        return HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                           max_retries=self.max_retries)
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._after_fork()
+
+    def _after_fork(self):
+        # the lock may have been held by another thread of the parent, and the inherited sockets belong to it:
+        # drop them without closing them
+        self._lock = RLock()
+        self._pid = os.getpid()
+        for entry in list(self._adapters.values()):
+            entry[0] = self._new_adapter()
+
+
+def reset_pools(adapter: HTTPAdapter):
+    # inherited sockets belong to the parent: drop them without closing them
+    adapter.init_poolmanager(adapter._pool_connections, adapter._pool_maxsize, block=adapter._pool_block)
+    adapter.proxy_manager = dict()
+
+
+def track_transport(transport: BaseAdapter):
+    _transport_pids.setdefault(transport, os.getpid())
+
+
+def check_transport_fork(transport: BaseAdapter):
+    """
+    Prepares a transport given by the caller to be used in a forked child, once per process. Its ``after_fork`` method
+    is called when it has one, otherwise the pools of an ``HTTPAdapter`` are replaced.
+    """
+    pid = os.getpid()
+    if _transport_pids.get(transport, pid) == pid:
+        return
+    _transport_pids[transport] = pid
+    after_fork = getattr(transport, 'after_fork', None)
+    if after_fork is not None:
+        after_fork()
+    elif isinstance(transport, HTTPAdapter):
+        reset_pools(transport)
+
+
+def _after_fork_in_child():
+    for registry in list(_registries):
+        registry._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -1,17 +1,27 @@
 import base64
 import logging
+import os
+import time
+import weakref
 from http import HTTPStatus
 from threading import Event
-from typing import Optional, Any, Callable
+from typing import Optional, Any, Callable, Tuple, Union
 from urllib.parse import quote, urlparse, unquote_plus
 
 import requests
 from requests import Response
+from requests.adapters import BaseAdapter
+from urllib3.exceptions import ReadTimeoutError, ProtocolError, DecodeError, SSLError
 
+from oauth2_client.client_assertion import ClientAssertion, CLIENT_ASSERTION_TYPE
+from oauth2_client.connection_pool import ConnectionPoolRegistry, track_transport, check_transport_fork
+from oauth2_client.discovery import ProviderMetadataCache, default_provider_metadata_cache
 from oauth2_client.http_server import start_http_server, stop_http_server
 
 _logger = logging.getLogger(__name__)
 
+_managers = weakref.WeakSet()
+
 
 class OAuthError(Exception):
     def __init__(self, status_code: HTTPStatus, error: str, error_description: Optional[str] = None):
@@ -23,27 +33,82 @@ class OAuthError(Exception):
         return '%d  - %s : %s' % (self.status_code.value, self.error, self.error_description)
 
 
+class OAuthTimeoutError(OAuthError):
+    def __init__(self, error_description: Optional[str] = None):
+        super(OAuthTimeoutError, self).__init__(HTTPStatus.GATEWAY_TIMEOUT, 'timeout', error_description)
+
+
+class Deadline(object):
+    def __init__(self, timeout: float, connect_timeout: Optional[float] = None):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def check(self) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise OAuthTimeoutError('deadline of %.3fs exceeded' % self.timeout)
+        return remaining
+
+    def request_timeout(self, timeout: Union[None, float, Tuple[float, float]] = None) -> Tuple[float, float]:
+        remaining = self.check()
+        connect_timeout = remaining if self.connect_timeout is None else min(self.connect_timeout, remaining)
+        read_timeout = remaining
+        # a timeout given by the caller still applies when it is shorter
+        if isinstance(timeout, tuple):
+            connect_timeout = connect_timeout if timeout[0] is None else min(timeout[0], connect_timeout)
+            read_timeout = read_timeout if timeout[1] is None else min(timeout[1], read_timeout)
+        elif timeout is not None:
+            connect_timeout = min(timeout, connect_timeout)
+            read_timeout = min(timeout, read_timeout)
+        return connect_timeout, read_timeout
+
+
 class ServiceInformation(object):
     def __init__(self, authorize_service: Optional[str],
                  token_service: Optional[str],
                  client_id: str, client_secret: Optional[str],
                  scopes: list,
-                 verify: bool = True):
+                 verify: bool = True,
+                 client_assertion: Optional[ClientAssertion] = None):
         self.authorize_service = authorize_service
         self.token_service = token_service
         self.client_id = client_id
         self.client_secret = client_secret
         self.scopes = scopes
         self.verify = verify
+        self.client_assertion = client_assertion
+        self.provider_metadata = None
+        self._authorization_header = None
+
+    @classmethod
+    def from_issuer(cls, issuer: str,
+                    client_id: str, client_secret: Optional[str],
+                    scopes: list,
+                    verify: bool = True,
+                    client_assertion: Optional[ClientAssertion] = None,
+                    cache: Optional[ProviderMetadataCache] = None) -> 'ServiceInformation':
+        cache = cache if cache is not None else default_provider_metadata_cache
+        metadata = cache.provider_metadata(issuer, verify)
+        service_information = cls(metadata.get('authorization_endpoint'), metadata['token_endpoint'],
+                                  client_id, client_secret, scopes, verify, client_assertion)
+        service_information.provider_metadata = metadata
+        return service_information
 
     @property
     def authorization_header(self):
-        return 'Basic %s' % base64.b64encode(bytes('%s:%s' % (self.client_id, self.client_secret), 'UTF-8'))\
-            .decode('UTF-8')
+        credentials = (self.client_id, self.client_secret)
+        if self._authorization_header is None or self._authorization_header[0] != credentials:
+            header = 'Basic %s' % base64.b64encode(bytes('%s:%s' % credentials, 'UTF-8')).decode('UTF-8')
+            self._authorization_header = (credentials, header)
+        return self._authorization_header[1]
 
     @property
     def public_api(self):
-        return self.client_secret is None
+        return self.client_secret is None and self.client_assertion is None
 
 
 class AuthorizeResponseCallback(dict):
@@ -67,19 +132,57 @@ class AuthorizationContext(object):
 
 
 class CredentialManager(object):
-    def __init__(self, service_information: ServiceInformation, proxies: Optional[dict] = None, user_agent: Optional[str] = None):
+    READ_CHUNK_SIZE = 65536
+
+    def __init__(self, service_information: ServiceInformation, proxies: Optional[dict] = None, user_agent: Optional[str] = None,
+                 default_deadline: Optional[float] = None, connect_timeout: Optional[float] = None,
+                 connection_pools: Optional[ConnectionPoolRegistry] = None, transport: Optional[BaseAdapter] = None):
+        if connection_pools is not None and transport is not None:
+            raise ValueError('connection_pools and transport cannot be used together')
         self.service_information = service_information
         self.proxies = proxies if proxies is not None else dict(http='', https='')
         self.user_agent = user_agent
+        self.default_deadline = default_deadline
+        self.connect_timeout = connect_timeout
         self.authorization_code_context = None
         self.refresh_token = None
         self._session = None
+        self._connection_pools = connection_pools
+        self._pool_key = None
+        self._adapter = transport
+        self._release_adapter = None
+        self._pid = os.getpid()
+        if connection_pools is not None:
+            self._pool_key = ConnectionPoolRegistry.key(self.proxies, service_information.verify)
+            self._adapter = connection_pools.acquire(self._pool_key)
+            self._release_adapter = weakref.finalize(self, connection_pools.release, self._pool_key)
+        elif transport is not None:
+            track_transport(transport)
+        _managers.add(self)
         if not service_information.verify:
             from requests.packages.urllib3.exceptions import InsecureRequestWarning
             import warnings
 
             warnings.filterwarnings('ignore', 'Unverified HTTPS request is being made.*', InsecureRequestWarning)
 
+    def __enter__(self) -> 'CredentialManager':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # shared adapter or given transport must not be closed by the sessions mounting it
+        if self._release_adapter is not None:
+            self._release_adapter()
+            self._release_adapter = None
+            self._connection_pools = None
+            self._pool_key = None
+            self._adapter = None
+        elif self._adapter is None and self._session is not None:
+            self._session.close()
+        self._session = None
+
     @staticmethod
     def _handle_bad_response(response: Response):
         try:
@@ -149,18 +252,19 @@ class CredentialManager(object):
                 stop_http_server(self.authorization_code_context.server)
                 self.authorization_code_context = None
 
-    def init_with_authorize_code(self, redirect_uri: str, code: str, **kwargs):
+    def init_with_authorize_code(self, redirect_uri: str, code: str, deadline: Union[None, float, Deadline] = None,
+                                 **kwargs):
         self._token_request(self._grant_code_request(code, redirect_uri, **kwargs),
-                            "offline_access" in self.service_information.scopes)
+                            "offline_access" in self.service_information.scopes, self._deadline(deadline))
 
-    def init_with_user_credentials(self, login: str, password: str):
-        self._token_request(self._grant_password_request(login, password), True)
+    def init_with_user_credentials(self, login: str, password: str, deadline: Union[None, float, Deadline] = None):
+        self._token_request(self._grant_password_request(login, password), True, self._deadline(deadline))
 
-    def init_with_client_credentials(self):
-        self._token_request(self._grant_client_credentials_request(), False)
+    def init_with_client_credentials(self, deadline: Union[None, float, Deadline] = None):
+        self._token_request(self._grant_client_credentials_request(), False, self._deadline(deadline))
 
-    def init_with_token(self, refresh_token: str):
-        self._token_request(self._grant_refresh_token_request(refresh_token), False)
+    def init_with_token(self, refresh_token: str, deadline: Union[None, float, Deadline] = None):
+        self._token_request(self._grant_refresh_token_request(refresh_token), False, self._deadline(deadline))
         if self.refresh_token is None:
             self.refresh_token = refresh_token
 
@@ -185,10 +289,10 @@ class CredentialManager(object):
                     scope=' '.join(self.service_information.scopes),
                     refresh_token=refresh_token)
 
-    def _refresh_token(self):
+    def _refresh_token(self, deadline: Optional[Deadline] = None):
         payload = self._grant_refresh_token_request(self.refresh_token)
         try:
-            self._token_request(payload, False)
+            self._token_request(payload, False, deadline)
         except OAuthError as err:
             if err.status_code == HTTPStatus.UNAUTHORIZED:
                 _logger.debug('refresh_token - unauthorized - cleaning token')
@@ -196,23 +300,40 @@ class CredentialManager(object):
                 self.refresh_token = None
             raise err
 
-    def _token_request(self, request_parameters: dict, refresh_token_mandatory: bool):
-        headers = self._token_request_headers(request_parameters['grant_type'])
-        if self.service_information.public_api:
-            request_parameters["client_id"] = self.service_information.client_id
-        else:
-            headers['Authorization'] = self.service_information.authorization_header
-        response = requests.post(self.service_information.token_service,
-                                 data=request_parameters,
-                                 headers=headers,
-                                 proxies=self.proxies,
-                                 verify=self.service_information.verify)
+    def _token_request(self, request_parameters: dict, refresh_token_mandatory: bool,
+                       deadline: Optional[Deadline] = None):
+        response, reused_assertion = self._send_token_request(request_parameters, deadline)
+        if reused_assertion and CredentialManager._is_invalid_client(response):
+            _logger.debug('_token_request - invalid_client - retrying with a new client assertion')
+            self.service_information.client_assertion.invalidate()
+            response, _ = self._send_token_request(request_parameters, deadline)
         if response.status_code != HTTPStatus.OK.value:
             CredentialManager._handle_bad_response(response)
         else:
             _logger.debug(response.text)
             self._process_token_response(response.json(), refresh_token_mandatory)
 
+    def _send_token_request(self, request_parameters: dict, deadline: Optional[Deadline]) -> Tuple[Response, bool]:
+        headers = self._token_request_headers(request_parameters['grant_type'])
+        reused_assertion = False
+        if self.service_information.public_api:
+            request_parameters["client_id"] = self.service_information.client_id
+        elif self.service_information.client_assertion is not None:
+            request_parameters["client_id"] = self.service_information.client_id
+            request_parameters["client_assertion_type"] = CLIENT_ASSERTION_TYPE
+            request_parameters["client_assertion"], reused_assertion = \
+                self.service_information.client_assertion.issue(self.service_information.client_id,
+                                                                self.service_information.token_service)
+        else:
+            headers['Authorization'] = self.service_information.authorization_header
+        response = CredentialManager._timed_request(deadline, self._token_post(),
+                                                    self.service_information.token_service,
+                                                    data=request_parameters,
+                                                    headers=headers,
+                                                    proxies=self.proxies,
+                                                    verify=self.service_information.verify)
+        return response, reused_assertion
+
     def _process_token_response(self, token_response: dict, refresh_token_mandatory: bool):
         self.refresh_token = token_response['refresh_token'] if refresh_token_mandatory \
             else token_response.get('refresh_token')
@@ -220,6 +341,7 @@ class CredentialManager(object):
 
     @property
     def _access_token(self) -> Optional[str]:
+        self._check_fork()
         authorization_header = self._session.headers.get('Authorization') if self._session is not None else None
         if authorization_header is not None:
             return authorization_header[len('Bearer '):]
@@ -228,11 +350,9 @@ class CredentialManager(object):
 
     @_access_token.setter
     def _access_token(self, access_token: str):
+        self._check_fork()
         if self._session is None:
-            self._session = requests.Session()
-            self._session.proxies = self.proxies
-            self._session.verify = self.service_information.verify
-            self._session.trust_env = False
+            self._session = self._new_session()
             if self.user_agent:
                 self._session.headers.update({'User-Agent': self.user_agent})
         if access_token is not None and len(access_token) > 0:
@@ -260,28 +380,151 @@ class CredentialManager(object):
     def delete(self, url: str, **kwargs) -> Response:
         return self._bearer_request(self._get_session().delete, url, **kwargs)
 
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        session.proxies = self.proxies
+        session.verify = self.service_information.verify
+        session.trust_env = False
+        if self._adapter is not None:
+            session.mount('https://', self._adapter)
+            session.mount('http://', self._adapter)
+        return session
+
+    def _token_post(self) -> Callable[..., Response]:
+        self._check_fork()
+        adapter = self._adapter
+        if adapter is None:
+            return requests.post
+
+        def post(url: str, **kwargs) -> Response:
+            # as requests.post: a new session honouring the environment, so that no cookie is kept between token
+            # requests; it is not closed as it would close the adapter
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            return session.post(url, **kwargs)
+
+        return post
+
     def _get_session(self) -> requests.Session:
+        self._check_fork()
         if self._session is None:
             raise OAuthError(HTTPStatus.UNAUTHORIZED, 'no_token', "no token provided")
         return self._session
 
-    def _bearer_request(self, method: Callable[[Any], Response], url: str, **kwargs) -> Response:
+    def _bearer_request(self, method: Callable[[Any], Response], url: str,
+                        deadline: Union[None, float, Deadline] = None, **kwargs) -> Response:
+        deadline = self._deadline(deadline)
         headers = kwargs.get('headers', None)
         if headers is None:
             headers = dict()
             kwargs['headers'] = headers
         _logger.debug("_bearer_request on %s - %s" % (method.__name__, url))
-        response = method(url, **kwargs)
+        response = CredentialManager._timed_request(deadline, method, url, **kwargs)
         if self.refresh_token is not None and self._is_token_expired(response):
-            self._refresh_token()
-            return method(url, **kwargs)
+            self._refresh_token(deadline)
+            return CredentialManager._timed_request(deadline, method, url, **kwargs)
         else:
             return response
 
+    def _deadline(self, deadline: Union[None, float, Deadline]) -> Optional[Deadline]:
+        if isinstance(deadline, Deadline):
+            return deadline
+        elif deadline is None and self.default_deadline is None:
+            return None
+        else:
+            return Deadline(deadline if deadline is not None else self.default_deadline, self.connect_timeout)
+
+    @staticmethod
+    def _timed_request(deadline: Optional[Deadline], method: Callable[[Any], Response], url: str,
+                       **kwargs) -> Response:
+        if deadline is None:
+            return method(url, **kwargs)
+        kwargs['timeout'] = deadline.request_timeout(kwargs.get('timeout'))
+        # the read timeout bounds each socket read only: the body is read here, checking the deadline between reads
+        stream = kwargs.get('stream', False)
+        kwargs['stream'] = True
+        try:
+            response = method(url, **kwargs)
+            if deadline.remaining() <= 0:
+                response.close()
+                deadline.check()
+            if not stream:
+                CredentialManager._read_content(response, deadline, kwargs['timeout'][1])
+            return response
+        except requests.exceptions.RequestException as ex:
+            if isinstance(ex, requests.exceptions.Timeout) \
+                    or isinstance(ex.__context__, ReadTimeoutError) \
+                    or any(isinstance(arg, ReadTimeoutError) for arg in ex.args) \
+                    or deadline.remaining() <= 0:
+                raise OAuthTimeoutError('%s - %s (%.3fs remaining)' % (url, str(ex), max(deadline.remaining(), 0)))
+            raise
+
+    @staticmethod
+    def _read_content(response: Response, deadline: Deadline, read_timeout: float):
+        if response._content_consumed:
+            return
+        read = getattr(response.raw, 'read1', response.raw.read)
+        chunks = []
+        try:
+            while True:
+                remaining = deadline.check()
+                sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+                if sock is not None:
+                    sock.settimeout(min(read_timeout, remaining))
+                chunk = read(CredentialManager.READ_CHUNK_SIZE, decode_content=True)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except BaseException as ex:
+            response.raw.close()
+            # same conversions as Response.iter_content
+            if isinstance(ex, ProtocolError):
+                raise requests.exceptions.ChunkedEncodingError(ex)
+            elif isinstance(ex, DecodeError):
+                raise requests.exceptions.ContentDecodingError(ex)
+            elif isinstance(ex, ReadTimeoutError):
+                raise requests.exceptions.ConnectionError(ex)
+            elif isinstance(ex, SSLError):
+                raise requests.exceptions.SSLError(ex)
+            raise
+        response._content = b''.join(chunks)
+        response._content_consumed = True
+        # gives the connection back to its pool
+        response.close()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._after_fork()
+
+    def _after_fork(self):
+        # sockets inherited from the parent stay with it: rebuild the sessions, keeping the token and headers
+        self._pid = os.getpid()
+        if self._connection_pools is not None:
+            self._adapter = self._connection_pools.adapter(self._pool_key)
+        elif self._adapter is not None:
+            check_transport_fork(self._adapter)
+        if self._session is not None:
+            session = self._new_session()
+            session.headers.clear()
+            session.headers.update(self._session.headers)
+            self._session = session
+
     @staticmethod
     def _token_request_headers(grant_type: str) -> dict:
         return dict()
 
+    @staticmethod
+    def _is_invalid_client(response: Response) -> bool:
+        if response.status_code in (HTTPStatus.BAD_REQUEST.value, HTTPStatus.UNAUTHORIZED.value):
+            try:
+                json_data = response.json()
+                return isinstance(json_data, dict) and json_data.get('error') == 'invalid_client'
+            except ValueError:
+                return False
+        else:
+            return False
+
     @staticmethod
     def _is_token_expired(response: Response) -> bool:
         if response.status_code == HTTPStatus.UNAUTHORIZED.value:
@@ -292,3 +535,12 @@ class CredentialManager(object):
                 return False
         else:
             return False
+
+
+def _after_fork_in_child():
+    for manager in list(_managers):
+        manager._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
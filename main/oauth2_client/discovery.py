@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import weakref
+from threading import Lock, Thread
+from typing import Optional, Tuple
+
+import requests
+
+_logger = logging.getLogger(__name__)
+
+WELL_KNOWN_PATH = '/.well-known/openid-configuration'
+
+_caches = weakref.WeakSet()
+
+
+class ProviderMetadataCache(object):
+    """
+    Caches JSON documents such as OpenID Connect discovery documents and JWKS, in memory and optionally in
+    ``cache_dir``. A document younger than ``ttl`` seconds is served without any request. An older one is still served
+    for ``stale_while_revalidate`` more seconds while a background thread fetches it again. Past that, the caller
+    waits for the fetch, and concurrent callers asking for the same document share a single request. In a forked child,
+    locks and background fetches inherited from the parent are forgotten.
+    """
+
+    def __init__(self, ttl: float = 3600, stale_while_revalidate: float = 86400, cache_dir: Optional[str] = None,
+                 proxies: Optional[dict] = None, timeout: Optional[float] = 10):
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.cache_dir = cache_dir
+        self.proxies = proxies if proxies is not None else dict(http='', https='')
+        self.timeout = timeout
+        self._entries = dict()
+        self._locks = dict()
+        self._revalidating = dict()
+        self._lock = Lock()
+        self._pid = os.getpid()
+        _caches.add(self)
+
+    def provider_metadata(self, issuer: str, verify: bool = True) -> dict:
+        metadata = self.get('%s%s' % (issuer.rstrip('/'), WELL_KNOWN_PATH), verify)
+        if metadata.get('issuer') != issuer:
+            raise ValueError('Issuer mismatch: expected %s, got %s' % (issuer, metadata.get('issuer')))
+        return metadata
+
+    def jwks(self, issuer: str, verify: bool = True) -> dict:
+        jwks_uri = self.provider_metadata(issuer, verify).get('jwks_uri')
+        if jwks_uri is None:
+            raise ValueError('No jwks_uri published by %s' % issuer)
+        return self.get(jwks_uri, verify)
+
+    def get(self, url: str, verify: bool = True) -> dict:
+        self._check_fork()
+        entry = self._entry(url)
+        if entry is not None:
+            document, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                return document
+            elif age < self.ttl + self.stale_while_revalidate:
+                self._revalidate(url, verify)
+                return document
+        with self._url_lock(url):
+            entry = self._entries.get(url)
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                return entry[0]
+            return self._fetch(url, verify)
+
+    def invalidate(self, url: Optional[str] = None):
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
+
+    def _entry(self, url: str) -> Optional[Tuple[dict, float]]:
+        entry = self._entries.get(url)
+        if entry is None and self.cache_dir is not None:
+            entry = self._load(url)
+            if entry is not None:
+                with self._lock:
+                    self._entries.setdefault(url, entry)
+        return entry
+
+    def _url_lock(self, url: str) -> Lock:
+        with self._lock:
+            lock = self._locks.get(url)
+            if lock is None:
+                lock = Lock()
+                self._locks[url] = lock
+            return lock
+
+    def _revalidate(self, url: str, verify: bool):
+        def run():
+            try:
+                with self._url_lock(url):
+                    self._fetch(url, verify)
+            except BaseException as ex:
+                _logger.warning('_revalidate - keeping stale document for %s - %s - %s', url, type(ex), str(ex))
+            finally:
+                with self._lock:
+                    self._revalidating.pop(url, None)
+
+        with self._lock:
+            if url in self._revalidating:
+                return
+            thread = Thread(target=run, daemon=True)
+            self._revalidating[url] = thread
+        thread.start()
+
+    def _fetch(self, url: str, verify: bool) -> dict:
+        _logger.debug('_fetch - %s', url)
+        response = requests.get(url, proxies=self.proxies, verify=verify, timeout=self.timeout)
+        response.raise_for_status()
+        document = response.json()
+        entry = (document, time.time())
+        with self._lock:
+            self._entries[url] = entry
+        if self.cache_dir is not None:
+            self._store(url, entry)
+        return document
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._after_fork()
+
+    def _after_fork(self):
+        # locks may be held by threads of the parent, which do not exist in the child
+        self._lock = Lock()
+        self._locks = dict()
+        self._revalidating = dict()
+        self._pid = os.getpid()
+
+    def _cache_file(self, url: str) -> str:
+        return os.path.join(self.cache_dir, '%s.json' % hashlib.sha256(url.encode('UTF-8')).hexdigest())
+
+    def _load(self, url: str) -> Optional[Tuple[dict, float]]:
+        try:
+            with open(self._cache_file(url), 'r') as f:
+                content = json.load(f)
+            if content.get('url') != url:
+                return None
+            return content['document'], float(content['fetched_at'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            _logger.warning('_load - ignoring cache file for %s - %s - %s', url, type(ex), str(ex))
+            return None
+
+    def _store(self, url: str, entry: Tuple[dict, float]):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(dict(url=url, fetched_at=entry[1], document=entry[0]), f)
+                os.replace(tmp_path, self._cache_file(url))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as ex:
+            _logger.warning('_store - cannot write cache file for %s - %s - %s', url, type(ex), str(ex))
+
+
+default_provider_metadata_cache = ProviderMetadataCache()
+
+
+def _after_fork_in_child():
+    for cache in list(_caches):
+        cache._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
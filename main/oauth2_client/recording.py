@@ -0,0 +1,263 @@
+import base64
+import datetime
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Optional, List, Union, Tuple, Any, Callable
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from requests import PreparedRequest, Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ConnectionError, ReadTimeout
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from oauth2_client.connection_pool import reset_pools
+
+_logger = logging.getLogger(__name__)
+
+SECRET_FIELDS = frozenset(['access_token', 'refresh_token', 'id_token', 'client_secret', 'client_assertion',
+                           'assertion', 'password', 'code', 'code_verifier'])
+
+
+def _redact_pairs(pairs: List[Tuple[str, str]], redact: Callable[[str], str]) -> List[Tuple[str, str]]:
+    return [(name, redact(value) if name in SECRET_FIELDS else value) for name, value in pairs]
+
+
+def _redact_url(url: str, redact: Callable[[str], str]) -> str:
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = urlencode(_redact_pairs(parse_qsl(parts.query, keep_blank_values=True), redact))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, parts.fragment))
+
+
+def _redact_document(document: Any, redact: Callable[[str], str]) -> Any:
+    if isinstance(document, dict):
+        return dict((name, redact(value) if name in SECRET_FIELDS and isinstance(value, str)
+                     else _redact_document(value, redact))
+                    for name, value in document.items())
+    elif isinstance(document, list):
+        return [_redact_document(value, redact) for value in document]
+    else:
+        return document
+
+
+def _open(path: str, mode: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='UTF-8')
+    return open(path, mode, encoding='UTF-8')
+
+
+class _RecordedBody(object):
+    """
+    Wraps the raw body of a response, keeping the chunks read by the caller. ``on_done`` gets the content read once the
+    end of the body is reached or the body is closed.
+    """
+
+    def __init__(self, raw: Any, on_done: Callable[[bytes], None]):
+        self._raw = raw
+        self._on_done = on_done
+        self._chunks = []
+        if hasattr(raw, 'read1'):
+            self.read1 = self._read1
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._raw, name)
+
+    def read(self, *args, **kwargs) -> bytes:
+        return self._keep(self._raw.read(*args, **kwargs))
+
+    def _read1(self, *args, **kwargs) -> bytes:
+        return self._keep(self._raw.read1(*args, **kwargs))
+
+    def stream(self, *args, **kwargs):
+        for chunk in self._raw.stream(*args, **kwargs):
+            yield self._keep(chunk)
+        self._done()
+
+    def close(self):
+        self._raw.close()
+        self._done()
+
+    def release_conn(self):
+        self._raw.release_conn()
+        self._done()
+
+    def _keep(self, chunk: bytes) -> bytes:
+        if chunk:
+            self._chunks.append(chunk)
+        else:
+            self._done()
+        return chunk
+
+    def _done(self):
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            on_done(b''.join(self._chunks))
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Transport adapter that sends requests as usual and records each exchange with its latency. Tokens, secrets,
+    passwords and codes found in urls, form parameters, ``Authorization`` headers and JSON responses are replaced by
+    placeholders before being kept. Placeholders are keyed with a random key drawn for each recording, so that a
+    given secret always gets the same placeholder within a recording but cannot be guessed back from it.
+    The body is recorded as the caller reads it, so that streamed and deadline-bound reads keep their behaviour: an
+    exchange is kept once its body has been read or its response closed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingAdapter, self).__init__(*args, **kwargs)
+        self.exchanges = []
+        self._lock = Lock()
+        self._redaction_key = os.urandom(32)
+
+    def redact(self, value: str) -> str:
+        return 'redacted-%s' % hmac.new(self._redaction_key, value.encode('UTF-8'), hashlib.sha256).hexdigest()[:16]
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        start = time.monotonic()
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        exchange = self._exchange(request, response, time.monotonic() - start)
+        response.raw = _RecordedBody(response.raw, lambda content: self._record(exchange, content))
+        return response
+
+    def _record(self, exchange: dict, content: bytes):
+        exchange.update(self._body(content))
+        with self._lock:
+            self.exchanges.append(exchange)
+
+    def after_fork(self):
+        # the lock may have been held by another thread of the parent
+        self._lock = Lock()
+        reset_pools(self)
+
+    def save(self, path: str):
+        with self._lock:
+            exchanges = list(self.exchanges)
+        with _open(path, 'w') as f:
+            for exchange in exchanges:
+                f.write(json.dumps(exchange, separators=(',', ':')))
+                f.write('\n')
+
+    def _exchange(self, request: PreparedRequest, response: Response, elapsed: float) -> dict:
+        exchange = dict(method=request.method, url=_redact_url(request.url, self.redact), elapsed=round(elapsed, 6),
+                        status=response.status_code, reason=response.reason)
+        authorization = request.headers.get('Authorization')
+        if authorization is not None:
+            scheme, _, credentials = authorization.partition(' ')
+            exchange['authorization'] = '%s %s' % (scheme, self.redact(credentials))
+        content_type = request.headers.get('Content-Type', '')
+        if content_type.startswith('application/x-www-form-urlencoded') and request.body:
+            body = request.body.decode('UTF-8') if isinstance(request.body, bytes) else request.body
+            exchange['form'] = _redact_pairs(parse_qsl(body, keep_blank_values=True), self.redact)
+        response_type = response.headers.get('Content-Type')
+        if response_type is not None:
+            exchange['content_type'] = response_type
+        return exchange
+
+    def _body(self, content: bytes) -> dict:
+        if not content:
+            return dict()
+        try:
+            text = content.decode('UTF-8')
+        except UnicodeDecodeError:
+            return dict(body_base64=base64.b64encode(content).decode('ascii'))
+        try:
+            document = json.loads(text)
+        except ValueError:
+            return dict(body=text)
+        redacted = _redact_document(document, self.redact)
+        if redacted != document:
+            return dict(body=json.dumps(redacted))
+        return dict(body=text)
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter serving recorded exchanges without any network access. Exchanges are matched on method, url
+    (values of secret parameters ignored) and ``grant_type`` for token requests, and served in their recorded order,
+    starting over once all of them have been served when ``loop`` is set. Each response is delayed by its recorded
+    latency multiplied by ``latency_scale``; give 0 to replay as fast as possible.
+    """
+
+    def __init__(self, exchanges: List[dict], latency_scale: float = 1.0, loop: bool = True):
+        super(ReplayAdapter, self).__init__()
+        self.latency_scale = latency_scale
+        self.loop = loop
+        self._exchanges = defaultdict(list)
+        self._positions = dict()
+        self._lock = Lock()
+        for exchange in exchanges:
+            self._exchanges[ReplayAdapter._key(exchange['method'], exchange['url'], exchange.get('form'))] \
+                .append(ReplayAdapter._prepare(exchange))
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'ReplayAdapter':
+        with _open(path, 'r') as f:
+            return cls([json.loads(line) for line in f if line.strip()], **kwargs)
+
+    def send(self, request: PreparedRequest, stream: bool = False,
+             timeout: Union[None, float, Tuple[float, float]] = None, **kwargs) -> Response:
+        form = None
+        if request.body and request.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            body = request.body.decode('UTF-8') if isinstance(request.body, bytes) else request.body
+            form = parse_qsl(body, keep_blank_values=True)
+        key = ReplayAdapter._key(request.method, request.url, form)
+        with self._lock:
+            recorded = self._exchanges.get(key)
+            position = self._positions.get(key, 0)
+            if not recorded or (position >= len(recorded) and not self.loop):
+                raise ConnectionError('No recorded exchange for %s %s' % key[:2], request=request)
+            self._positions[key] = position + 1
+        status, reason, headers, content, elapsed = recorded[position % len(recorded)]
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        latency = elapsed * self.latency_scale
+        if read_timeout is not None and latency > read_timeout:
+            time.sleep(read_timeout)
+            raise ReadTimeout('Replayed latency %.3fs exceeds read timeout %.3fs' % (latency, read_timeout),
+                              request=request)
+        if latency > 0:
+            time.sleep(latency)
+        response = Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=latency)
+        return response
+
+    def close(self):
+        pass
+
+    def after_fork(self):
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(method: str, url: str, form: Optional[List[Tuple[str, str]]]) -> tuple:
+        grant_type = None
+        if form is not None:
+            grant_type = next((value for name, value in form if name == 'grant_type'), None)
+        return method, _redact_url(url, lambda value: ''), grant_type
+
+    @staticmethod
+    def _prepare(exchange: dict) -> tuple:
+        if 'body_base64' in exchange:
+            content = base64.b64decode(exchange['body_base64'])
+        else:
+            content = exchange.get('body', '').encode('UTF-8')
+        headers = dict()
+        if 'content_type' in exchange:
+            headers['Content-Type'] = exchange['content_type']
+        return exchange['status'], exchange.get('reason'), headers, content, exchange.get('elapsed', 0)
@@ -0,0 +1,71 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import time
+import unittest
+from unittest import mock
+
+from oauth2_client.client_assertion import ClientAssertion, ClientSecretJwt, PrivateKeyJwt
+
+_logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.DEBUG,
+                    format='%(levelname)5s - %(name)s -  %(message)s')
+
+
+def _decode(segment):
+    return json.loads(base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4)))
+
+
+class TestClientAssertion(unittest.TestCase):
+    def test_client_secret_jwt(self):
+        assertion = ClientSecretJwt('the secret').get('client_id_test', 'https://token-server/oauth/token')
+        header, claims, signature = assertion.split('.')
+        self.assertEqual(dict(alg='HS256', typ='JWT'), _decode(header))
+        claims = _decode(claims)
+        self.assertEqual('client_id_test', claims['iss'])
+        self.assertEqual('client_id_test', claims['sub'])
+        self.assertEqual('https://token-server/oauth/token', claims['aud'])
+        self.assertEqual(300, claims['exp'] - claims['iat'])
+        expected = hmac.new(b'the secret', ('%s.%s' % tuple(assertion.split('.')[:2])).encode('ascii'),
+                            hashlib.sha256).digest()
+        self.assertEqual(base64.urlsafe_b64encode(expected).rstrip(b'=').decode('ascii'), signature)
+
+    def test_assertion_reused_until_margin(self):
+        signer = mock.MagicMock(return_value=b'signature')
+        client_assertion = PrivateKeyJwt(signer, key_id='key-1', lifetime=60, reuse_margin=10, max_uses=None)
+        first = client_assertion.get('client_id_test', 'audience')
+        self.assertEqual(first, client_assertion.get('client_id_test', 'audience'))
+        self.assertEqual(1, signer.call_count)
+        self.assertEqual(dict(alg='RS256', typ='JWT', kid='key-1'), _decode(first.split('.')[0]))
+        self.assertNotEqual(first, client_assertion.get('client_id_test', 'other_audience'))
+        with mock.patch('oauth2_client.client_assertion.time.time', return_value=time.time() + 51):
+            self.assertNotEqual(first, client_assertion.get('client_id_test', 'audience'))
+        self.assertEqual(3, signer.call_count)
+
+    def test_new_assertion_by_default(self):
+        client_assertion = ClientSecretJwt('the secret')
+        first = client_assertion.get('client_id_test', 'audience')
+        second = client_assertion.get('client_id_test', 'audience')
+        self.assertNotEqual(_decode(first.split('.')[1])['jti'], _decode(second.split('.')[1])['jti'])
+
+    def test_invalidate(self):
+        client_assertion = ClientSecretJwt('the secret', max_uses=None)
+        first = client_assertion.get('client_id_test', 'audience')
+        client_assertion.invalidate()
+        self.assertNotEqual(first, client_assertion.get('client_id_test', 'audience'))
+
+    def test_assertion_max_uses(self):
+        client_assertion = ClientSecretJwt('the secret', max_uses=2)
+        first = client_assertion.get('client_id_test', 'audience')
+        self.assertEqual(first, client_assertion.get('client_id_test', 'audience'))
+        self.assertNotEqual(first, client_assertion.get('client_id_test', 'audience'))
+
+    def test_abstract(self):
+        self.assertRaises(TypeError, ClientAssertion, 'HS256')
+
+    def test_invalid_parameters(self):
+        self.assertRaises(ValueError, ClientSecretJwt, 'the secret', algorithm='RS256')
+        self.assertRaises(ValueError, ClientSecretJwt, 'the secret', lifetime=30, reuse_margin=30)
+        self.assertRaises(ValueError, ClientSecretJwt, 'the secret', max_uses=0)
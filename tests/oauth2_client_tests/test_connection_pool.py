@@ -0,0 +1,190 @@
+import gc
+import logging
+import os
+import threading
+import unittest
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from oauth2_client.connection_pool import ConnectionPoolRegistry
+from oauth2_client.credentials_manager import CredentialManager, ServiceInformation, OAuthError
+from oauth2_client.http_server import _ReuseAddressTcpServer
+from oauth2_client.recording import RecordingAdapter
+
+_logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.DEBUG,
+                    format='%(levelname)5s - %(name)s -  %(message)s')
+
+api_server_port = 9094
+
+service_information = ServiceInformation(
+    authorize_service='http://localhost:%d/oauth/authorize' % api_server_port,
+    token_service='http://localhost:%d/oauth/token' % api_server_port,
+    client_id='client_id_test',
+    client_secret='client_secret_test',
+    scopes=['scope1', 'scope2'])
+
+
+class _ThreadingServer(ThreadingMixIn, _ReuseAddressTcpServer):
+    daemon_threads = True
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    RECEIVED = []
+    TOKEN_REQUESTS = []
+
+    def do_GET(self):
+        KeepAliveHandler.RECEIVED.append((self.client_address, self.headers.get('Authorization')))
+        self.send_response(HTTPStatus.OK.value, 'OK')
+        self.send_header("Content-Length", 0)
+        self.end_headers()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        KeepAliveHandler.TOKEN_REQUESTS.append((self.client_address, self.headers.get('Cookie')))
+        self.send_response(HTTPStatus.BAD_REQUEST.value, 'Bad Request')
+        self.send_header("Set-Cookie", 'session=token-endpoint')
+        self.send_header("Content-Length", 0)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestConnectionPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.httpd = _ThreadingServer('', api_server_port, KeepAliveHandler)
+        threading.Thread(target=cls.httpd.serve_forever).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def setUp(self):
+        KeepAliveHandler.RECEIVED = []
+        KeepAliveHandler.TOKEN_REQUESTS = []
+
+    def test_registry_reference_count(self):
+        registry = ConnectionPoolRegistry()
+        key = ConnectionPoolRegistry.key(dict(http=''), True)
+        adapter = registry.acquire(key)
+        self.assertIs(adapter, registry.acquire(ConnectionPoolRegistry.key(dict(http=''), True)))
+        self.assertIsNot(adapter, registry.acquire(ConnectionPoolRegistry.key(dict(http=''), False)))
+        self.assertEqual(2, len(registry))
+        registry.release(key)
+        self.assertEqual(2, len(registry))
+        registry.release(key)
+        self.assertEqual(1, len(registry))
+
+    def test_release_from_finalizer_while_locked(self):
+        registry = ConnectionPoolRegistry()
+        key = ConnectionPoolRegistry.key(dict(http=''), True)
+        registry.acquire(key)
+
+        def collect_while_locked():
+            # what happens when the garbage collector finalizes a manager while the registry is in use
+            with registry._lock:
+                registry.release(key)
+
+        thread = threading.Thread(target=collect_while_locked, daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(0, len(registry))
+
+    def test_shared_pool_isolated_tokens(self):
+        registry = ConnectionPoolRegistry()
+        api_url = 'http://localhost:%d/api/uri' % api_server_port
+        managers = [CredentialManager(service_information, proxies=dict(http=''), connection_pools=registry)
+                    for _ in range(3)]
+        for idx, manager in enumerate(managers):
+            manager._access_token = 'access token %d' % idx
+            manager.get(api_url)
+        self.assertEqual(['Bearer access token %d' % idx for idx in range(3)],
+                         [authorization for _, authorization in KeepAliveHandler.RECEIVED])
+        self.assertEqual(1, len(set(client_address for client_address, _ in KeepAliveHandler.RECEIVED)))
+        self.assertEqual(1, len(registry))
+        managers[0].close()
+        managers[0].close()
+        self.assertEqual(1, len(registry))
+        with managers[1]:
+            pass
+        self.assertEqual(1, len(registry))
+        del managers, manager
+        gc.collect()
+        self.assertEqual(0, len(registry))
+
+    def test_use_after_close(self):
+        registry = ConnectionPoolRegistry()
+        api_url = 'http://localhost:%d/api/uri' % api_server_port
+        manager = CredentialManager(service_information, proxies=dict(http=''), connection_pools=registry)
+        manager._access_token = 'access token'
+        manager.get(api_url)
+        shared_adapter = manager._session.get_adapter(api_url)
+        manager.close()
+        self.assertEqual(0, len(registry))
+        manager._access_token = 'new access token'
+        manager.get(api_url)
+        self.assertIsNot(shared_adapter, manager._session.get_adapter(api_url))
+        self.assertEqual(0, len(registry))
+        self.assertEqual('Bearer new access token', KeepAliveHandler.RECEIVED[-1][1])
+        manager.close()
+
+    def test_token_requests_without_cookies(self):
+        registry = ConnectionPoolRegistry()
+        manager = CredentialManager(service_information, proxies=dict(http=''), connection_pools=registry)
+        self.assertRaises(OAuthError, manager.init_with_client_credentials)
+        self.assertRaises(OAuthError, manager.init_with_client_credentials)
+        self.assertEqual([None, None], [cookie for _, cookie in KeepAliveHandler.TOKEN_REQUESTS])
+        self.assertEqual(1, len(set(client_address for client_address, _ in KeepAliveHandler.TOKEN_REQUESTS)))
+        manager.close()
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork not available')
+    def test_forked_children_rebuild_pools(self):
+        self._test_forked_children(None)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork not available')
+    def test_forked_children_rebuild_shared_pools(self):
+        self._test_forked_children(ConnectionPoolRegistry())
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork not available')
+    def test_forked_children_rebuild_transport_pools(self):
+        self._test_forked_children(None, RecordingAdapter())
+
+    def _test_forked_children(self, registry, transport=None):
+        api_url = 'http://localhost:%d/api/uri' % api_server_port
+        manager = CredentialManager(service_information, proxies=dict(http=''), connection_pools=registry,
+                                    transport=transport)
+        manager._access_token = 'inherited access token'
+        manager.refresh_token = 'inherited refresh token'
+        manager.get(api_url)
+        children = []
+        for _ in range(8):
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 1
+                try:
+                    if manager.get(api_url, deadline=5).status_code == HTTPStatus.OK.value \
+                            and manager.get(api_url, deadline=5).status_code == HTTPStatus.OK.value:
+                        exit_code = 0
+                finally:
+                    os._exit(exit_code)
+            children.append(pid)
+        for pid in children:
+            _, status = os.waitpid(pid, 0)
+            self.assertTrue(os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0)
+        manager.get(api_url)
+        self.assertEqual([], KeepAliveHandler.TOKEN_REQUESTS)
+        self.assertEqual(18, len(KeepAliveHandler.RECEIVED))
+        self.assertEqual({'Bearer inherited access token'},
+                         set(authorization for _, authorization in KeepAliveHandler.RECEIVED))
+        parent_address = KeepAliveHandler.RECEIVED[0][0]
+        self.assertEqual(parent_address, KeepAliveHandler.RECEIVED[-1][0])
+        child_addresses = [client_address for client_address, _ in KeepAliveHandler.RECEIVED[1:-1]]
+        self.assertNotIn(parent_address, child_addresses)
+        self.assertEqual(8, len(set(child_addresses)))
+        manager.close()
@@ -1,6 +1,7 @@
 import json
 import logging
 import threading
+import time
 import unittest
 from cgi import parse_header
 from http import HTTPStatus
@@ -9,7 +10,9 @@ from urllib.parse import urlparse, parse_qs
 
 import requests
 
-from oauth2_client.credentials_manager import CredentialManager, ServiceInformation, OAuthError
+from oauth2_client.client_assertion import ClientSecretJwt, PrivateKeyJwt, CLIENT_ASSERTION_TYPE
+from oauth2_client.credentials_manager import CredentialManager, ServiceInformation, OAuthError, \
+    OAuthTimeoutError, Deadline
 from oauth2_client.http_server import read_request_parameters, _ReuseAddressTcpServer
 
 _logger = logging.getLogger(__name__)
@@ -288,6 +291,223 @@ class TestManager(unittest.TestCase):
                 self.assertIsNone(manager.refresh_token)
             self.assertEqual(manager._access_token, access_token)
 
+    def test_get_token_with_client_assertion(self):
+        test_case = self
+        assertions_received = []
+        jwt_service_information = ServiceInformation(service_information.authorize_service,
+                                                     service_information.token_service,
+                                                     service_information.client_id,
+                                                     None,
+                                                     service_information.scopes,
+                                                     client_assertion=ClientSecretJwt('client_secret_test'))
+
+        class CheckClientAssertion(FakeOAuthHandler):
+            def _handle_post(self, parameters):
+                test_case.assertIsNone(self.headers.get('Authorization', None))
+                test_case.assertEqual([b'client_id_test'], parameters.get(b'client_id'))
+                test_case.assertEqual([bytes(CLIENT_ASSERTION_TYPE, 'UTF-8')],
+                                      parameters.get(b'client_assertion_type'))
+                assertions_received.extend(parameters.get(b'client_assertion'))
+                response = json.dumps(dict(access_token='the access token'))
+                self.send_response(HTTPStatus.OK.value, 'OK')
+                self.send_header("Content-type", 'application/json')
+                self.send_header("Content-Length", len(response))
+                self.end_headers()
+                self.wfile.write(bytes(response, 'UTF-8'))
+
+        with TestServer(token_server_port, CheckClientAssertion):
+            manager = CredentialManager(jwt_service_information, proxies=dict(http=''))
+            manager.init_with_client_credentials()
+            manager.init_with_client_credentials()
+            self.assertEqual(manager._access_token, 'the access token')
+        self.assertEqual(2, len(assertions_received))
+        self.assertNotEqual(assertions_received[0], assertions_received[1])
+
+    def test_rejected_client_assertion_renewed(self):
+        assertions_received = []
+        jwt_service_information = ServiceInformation(service_information.authorize_service,
+                                                     service_information.token_service,
+                                                     service_information.client_id,
+                                                     None,
+                                                     service_information.scopes,
+                                                     client_assertion=ClientSecretJwt('client_secret_test',
+                                                                                      max_uses=None))
+
+        class RejectReplayedAssertion(FakeOAuthHandler):
+            def _handle_post(self, parameters):
+                assertion = parameters.get(b'client_assertion')[0]
+                if assertion in assertions_received:
+                    status, body = HTTPStatus.UNAUTHORIZED, dict(error='invalid_client')
+                else:
+                    status, body = HTTPStatus.OK, dict(access_token='the access token')
+                assertions_received.append(assertion)
+                response = json.dumps(body)
+                self.send_response(status.value, status.phrase)
+                self.send_header("Content-type", 'application/json')
+                self.send_header("Content-Length", len(response))
+                self.end_headers()
+                self.wfile.write(bytes(response, 'UTF-8'))
+
+        with TestServer(token_server_port, RejectReplayedAssertion):
+            manager = CredentialManager(jwt_service_information, proxies=dict(http=''))
+            manager.init_with_client_credentials()
+            manager.init_with_client_credentials()
+            self.assertEqual(manager._access_token, 'the access token')
+        self.assertEqual(3, len(assertions_received))
+        self.assertEqual(assertions_received[0], assertions_received[1])
+        self.assertNotEqual(assertions_received[1], assertions_received[2])
+
+    def test_rejected_new_client_assertion_not_retried(self):
+        signatures = []
+        requests_received = []
+
+        def signer(signing_input):
+            signatures.append(signing_input)
+            return b'signature'
+
+        jwt_service_information = ServiceInformation(service_information.authorize_service,
+                                                     service_information.token_service,
+                                                     service_information.client_id,
+                                                     None,
+                                                     service_information.scopes,
+                                                     client_assertion=PrivateKeyJwt(signer))
+
+        class RejectAssertion(FakeOAuthHandler):
+            def _handle_post(self, parameters):
+                requests_received.append(parameters)
+                response = json.dumps(dict(error='invalid_client'))
+                self.send_response(HTTPStatus.UNAUTHORIZED.value, HTTPStatus.UNAUTHORIZED.phrase)
+                self.send_header("Content-type", 'application/json')
+                self.send_header("Content-Length", len(response))
+                self.end_headers()
+                self.wfile.write(bytes(response, 'UTF-8'))
+
+        with TestServer(token_server_port, RejectAssertion):
+            manager = CredentialManager(jwt_service_information, proxies=dict(http=''))
+            self.assertRaises(OAuthError, manager.init_with_client_credentials)
+        self.assertEqual(1, len(requests_received))
+        self.assertEqual(1, len(signatures))
+
+    def test_token_request_deadline(self):
+        class SlowTokenHandler(FakeOAuthHandler):
+            def _handle_post(self, parameters):
+                time.sleep(0.5)
+                super(SlowTokenHandler, self)._handle_post(parameters)
+
+        with TestServer(token_server_port, SlowTokenHandler):
+            manager = CredentialManager(service_information, proxies=dict(http=''), default_deadline=0.2)
+            self.assertRaises(OAuthTimeoutError, manager.init_with_client_credentials)
+            self.assertRaises(OAuthTimeoutError, manager.init_with_user_credentials, 'login', 'password', 0.1)
+
+    def test_deadline_covers_refresh_and_replay(self):
+        tokens_requested = []
+
+        class RefreshHandler(FakeOAuthHandler):
+            def _handle_post(self, parameters):
+                tokens_requested.append(parameters)
+                time.sleep(0.3)
+                response = json.dumps(dict(access_token='new access token'))
+                self.send_response(HTTPStatus.OK.value, 'OK')
+                self.send_header("Content-type", 'application/json')
+                self.send_header("Content-Length", len(response))
+                self.end_headers()
+                self.wfile.write(bytes(response, 'UTF-8'))
+
+        class ExpiredTokenHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(0.3)
+                response = json.dumps(dict(error='invalid_token'))
+                self.send_response(HTTPStatus.UNAUTHORIZED.value, 'Unauthorized')
+                self.send_header("Content-type", 'application/json')
+                self.send_header("Content-Length", len(response))
+                self.end_headers()
+                self.wfile.write(bytes(response, 'UTF-8'))
+
+        with TestServer(token_server_port, RefreshHandler), TestServer(api_server_port, ExpiredTokenHandler):
+            api_url = 'http://localhost:%d/api/uri' % api_server_port
+            manager = CredentialManager(service_information, proxies=dict(http=''))
+            manager._access_token = 'expired access token'
+            manager.refresh_token = 'the refresh token'
+            start = time.monotonic()
+            self.assertRaises(OAuthTimeoutError, manager.get, api_url, deadline=0.75)
+            self.assertLess(time.monotonic() - start, 0.85)
+            self.assertEqual(1, len(tokens_requested))
+
+    def test_deadline_covers_body_download(self):
+        class TrickleHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(HTTPStatus.OK.value, 'OK')
+                self.send_header("Content-type", 'text/plain')
+                self.send_header("Content-Length", 20)
+                self.end_headers()
+                try:
+                    for _ in range(20):
+                        self.wfile.write(b'x')
+                        self.wfile.flush()
+                        time.sleep(0.1)
+                except OSError:
+                    pass
+
+        with TestServer(api_server_port, TrickleHandler):
+            api_url = 'http://localhost:%d/api/uri' % api_server_port
+            manager = CredentialManager(service_information, proxies=dict(http=''))
+            manager._access_token = 'the access token'
+            start = time.monotonic()
+            self.assertRaises(OAuthTimeoutError, manager.get, api_url, deadline=0.5)
+            self.assertLess(time.monotonic() - start, 0.7)
+            self.assertEqual(b'x' * 20, manager.get(api_url, deadline=5).content)
+
+    def test_token_request_stalled_body(self):
+        class StalledTokenHandler(FakeOAuthHandler):
+            def _handle_post(self, parameters):
+                self.send_response(HTTPStatus.OK.value, 'OK')
+                self.send_header("Content-type", 'application/json')
+                self.send_header("Content-Length", 100)
+                self.end_headers()
+                self.wfile.flush()
+                time.sleep(0.6)
+
+        with TestServer(token_server_port, StalledTokenHandler):
+            manager = CredentialManager(service_information, proxies=dict(http=''))
+            start = time.monotonic()
+            self.assertRaises(OAuthTimeoutError, manager.init_with_client_credentials, 0.3)
+            self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_body_read_errors(self):
+        class BrokenBodyHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.close_connection = True
+                self.send_response(HTTPStatus.OK.value, 'OK')
+                self.send_header("Content-type", 'text/plain')
+                self.send_header("Content-Length", 100)
+                self.end_headers()
+                self.wfile.write(b'x' * 10)
+                self.wfile.flush()
+                if self.path == '/api/stalled':
+                    time.sleep(0.6)
+
+        with TestServer(api_server_port, BrokenBodyHandler):
+            api_url = 'http://localhost:%d/api' % api_server_port
+            manager = CredentialManager(service_information, proxies=dict(http=''))
+            manager._access_token = 'the access token'
+            start = time.monotonic()
+            self.assertRaises(OAuthTimeoutError, manager.get, '%s/stalled' % api_url, deadline=5, timeout=0.2)
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertRaises(requests.exceptions.ChunkedEncodingError, manager.get, '%s/truncated' % api_url,
+                              deadline=5)
+
+    def test_deadline_exceeded(self):
+        deadline = Deadline(0, connect_timeout=1)
+        self.assertRaises(OAuthTimeoutError, deadline.request_timeout)
+        connect_timeout, read_timeout = Deadline(10, connect_timeout=1).request_timeout()
+        self.assertEqual(1, connect_timeout)
+        self.assertLessEqual(read_timeout, 10)
+        self.assertEqual((0.5, 0.5), Deadline(10).request_timeout(0.5))
+        connect_timeout, read_timeout = Deadline(10, connect_timeout=1).request_timeout((2, 3))
+        self.assertEqual((1, 3), (connect_timeout, read_timeout))
+
     def test_default_user_agent(self):
         manager = CredentialManager(service_information, proxies=dict(http=''))
         manager._access_token = 'a-access-token'
@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+from unittest import mock
+
+from oauth2_client.credentials_manager import ServiceInformation
+from oauth2_client.discovery import ProviderMetadataCache
+from oauth2_client.http_server import _ReuseAddressTcpServer
+
+_logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.DEBUG,
+                    format='%(levelname)5s - %(name)s -  %(message)s')
+
+discovery_server_port = 9093
+issuer = 'http://localhost:%d/realm' % discovery_server_port
+
+
+class DiscoveryHandler(BaseHTTPRequestHandler):
+    HITS = []
+    DELAY = 0
+
+    def do_GET(self):
+        DiscoveryHandler.HITS.append(self.path)
+        time.sleep(DiscoveryHandler.DELAY)
+        if self.path == '/realm/.well-known/openid-configuration':
+            body = dict(issuer=issuer,
+                        authorization_endpoint='%s/protocol/auth' % issuer,
+                        token_endpoint='%s/protocol/token' % issuer,
+                        jwks_uri='%s/protocol/certs' % issuer)
+        elif self.path == '/realm/protocol/certs':
+            body = dict(keys=[dict(kid='key-1', kty='RSA')])
+        else:
+            self.send_response(HTTPStatus.NOT_FOUND.value, 'Not Found')
+            self.send_header("Content-Length", 0)
+            self.end_headers()
+            return
+        response = json.dumps(body)
+        self.send_response(HTTPStatus.OK.value, 'OK')
+        self.send_header("Content-type", 'application/json')
+        self.send_header("Content-Length", len(response))
+        self.end_headers()
+        self.wfile.write(bytes(response, 'UTF-8'))
+
+
+class TestDiscovery(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.httpd = _ReuseAddressTcpServer('', discovery_server_port, DiscoveryHandler)
+        threading.Thread(target=cls.httpd.serve_forever).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        cls.httpd.server_close()
+
+    def setUp(self):
+        DiscoveryHandler.HITS = []
+        DiscoveryHandler.DELAY = 0
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_from_issuer(self):
+        cache = ProviderMetadataCache()
+        service_information = ServiceInformation.from_issuer(issuer, 'client_id_test', 'client_secret_test',
+                                                             ['openid'], cache=cache)
+        self.assertEqual('%s/protocol/auth' % issuer, service_information.authorize_service)
+        self.assertEqual('%s/protocol/token' % issuer, service_information.token_service)
+        self.assertEqual('%s/protocol/certs' % issuer, service_information.provider_metadata['jwks_uri'])
+        ServiceInformation.from_issuer(issuer, 'other_client', None, ['openid'], cache=cache)
+        self.assertEqual(1, len(DiscoveryHandler.HITS))
+
+    def test_issuer_mismatch(self):
+        cache = ProviderMetadataCache()
+        other_issuer = 'http://localhost:%d/other' % discovery_server_port
+        cache._entries['%s/.well-known/openid-configuration' % other_issuer] = (dict(issuer=issuer), time.time())
+        self.assertRaises(ValueError, cache.provider_metadata, other_issuer)
+        self.assertRaises(ValueError, cache.provider_metadata, '%s/' % issuer)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork not available')
+    def test_fork_during_revalidation(self):
+        cache = ProviderMetadataCache()
+        url = '%s/.well-known/openid-configuration' % issuer
+        lock = cache._url_lock(url)
+        lock.acquire()
+        cache._revalidating[url] = threading.Thread(target=lambda: None)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                exit_code = 1
+                try:
+                    if cache.provider_metadata(issuer)['issuer'] == issuer and url not in cache._revalidating:
+                        exit_code = 0
+                finally:
+                    os._exit(exit_code)
+        finally:
+            lock.release()
+        for _ in range(100):
+            child_pid, status = os.waitpid(pid, os.WNOHANG)
+            if child_pid != 0:
+                break
+            time.sleep(0.1)
+        else:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+            self.fail('child blocked on a lock inherited from its parent')
+        self.assertTrue(os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0)
+
+    def test_jwks(self):
+        cache = ProviderMetadataCache()
+        self.assertEqual('key-1', cache.jwks(issuer)['keys'][0]['kid'])
+        cache.jwks(issuer)
+        self.assertEqual(2, len(DiscoveryHandler.HITS))
+
+    def test_disk_cache(self):
+        ProviderMetadataCache(cache_dir=self.cache_dir).provider_metadata(issuer)
+        metadata = ProviderMetadataCache(cache_dir=self.cache_dir).provider_metadata(issuer)
+        self.assertEqual('%s/protocol/token' % issuer, metadata['token_endpoint'])
+        self.assertEqual(1, len(DiscoveryHandler.HITS))
+
+    def test_stale_while_revalidate(self):
+        cache = ProviderMetadataCache(ttl=10, stale_while_revalidate=10)
+        url = '%s/.well-known/openid-configuration' % issuer
+        cache.get(url)
+        DiscoveryHandler.DELAY = 0.2
+        with mock.patch('oauth2_client.discovery.time.time', return_value=time.time() + 15):
+            cache.get(url)
+            thread = cache._revalidating.get(url)
+            self.assertIsNotNone(thread)
+            thread.join()
+        self.assertEqual(2, len(DiscoveryHandler.HITS))
+        cache.get(url)
+        self.assertEqual(2, len(DiscoveryHandler.HITS))
+
+    def test_expired_fetch_blocks(self):
+        cache = ProviderMetadataCache(ttl=10, stale_while_revalidate=10)
+        url = '%s/.well-known/openid-configuration' % issuer
+        cache.get(url)
+        with mock.patch('oauth2_client.discovery.time.time', return_value=time.time() + 25):
+            cache.get(url)
+            self.assertNotIn(url, cache._revalidating)
+        self.assertEqual(2, len(DiscoveryHandler.HITS))
+
+    def test_single_fetch_when_cold(self):
+        cache = ProviderMetadataCache()
+        DiscoveryHandler.DELAY = 0.2
+        threads = [threading.Thread(target=cache.provider_metadata, args=(issuer,)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(DiscoveryHandler.HITS))
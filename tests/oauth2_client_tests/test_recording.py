@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+
+import requests
+
+from oauth2_client.credentials_manager import CredentialManager, ServiceInformation, OAuthTimeoutError
+from oauth2_client.http_server import _ReuseAddressTcpServer
+from oauth2_client.recording import RecordingAdapter, ReplayAdapter
+
+_logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.DEBUG,
+                    format='%(levelname)5s - %(name)s -  %(message)s')
+
+server_port = 9095
+
+service_information = ServiceInformation(
+    authorize_service='http://localhost:%d/oauth/authorize' % server_port,
+    token_service='http://localhost:%d/oauth/token' % server_port,
+    client_id='client_id_test',
+    client_secret='client_secret_test',
+    scopes=['scope1', 'scope2'])
+
+api_url = 'http://localhost:%d/api/uri' % server_port
+
+
+class TokenAndApiHandler(BaseHTTPRequestHandler):
+    GENERATION = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        TokenAndApiHandler.GENERATION += 1
+        self._send_json(HTTPStatus.OK, dict(access_token='access token %d' % TokenAndApiHandler.GENERATION,
+                                            refresh_token='refresh token %d' % TokenAndApiHandler.GENERATION,
+                                            token_type='bearer'))
+
+    def do_GET(self):
+        time.sleep(0.05)
+        if self.headers.get('Authorization') == 'Bearer access token 2':
+            self._send_json(HTTPStatus.OK, dict(value='resource',
+                                                links=[dict(rel='delegation', access_token='nested token')]))
+        else:
+            self._send_json(HTTPStatus.UNAUTHORIZED, dict(error='invalid_token'))
+
+    def _send_json(self, status, body):
+        response = json.dumps(body)
+        self.send_response(status.value, status.phrase)
+        self.send_header("Content-type", 'application/json')
+        self.send_header("Content-Length", len(response))
+        self.end_headers()
+        self.wfile.write(bytes(response, 'UTF-8'))
+
+
+class TestRecording(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'exchanges.jsonl.gz')
+        TokenAndApiHandler.GENERATION = 0
+        httpd = _ReuseAddressTcpServer('', server_port, TokenAndApiHandler)
+        threading.Thread(target=httpd.serve_forever).start()
+        try:
+            self.recorder = RecordingAdapter()
+            manager = CredentialManager(service_information, proxies=dict(http=''), transport=self.recorder)
+            manager.init_with_user_credentials('login', 'the password')
+            self.assertEqual('resource', manager.get(api_url).json()['value'])
+            self.recorder.save(self.path)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_secrets_redacted(self):
+        with gzip.open(self.path, 'rt') as f:
+            content = f.read()
+        exchanges = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(['POST', 'GET', 'POST', 'GET'], [exchange['method'] for exchange in exchanges])
+        self.assertEqual([200, 401, 200, 200], [exchange['status'] for exchange in exchanges])
+        for secret in ('the password', 'client_secret_test', 'access token', 'refresh token', 'nested token',
+                       'Y2xpZW50X2lkX3Rlc3Q6Y2xpZW50X3NlY3JldF90ZXN0',
+                       hashlib.sha256(b'the password').hexdigest()[:16]):
+            self.assertNotIn(secret, content)
+        self.assertIn(['password', self.recorder.redact('the password')], exchanges[0]['form'])
+        self.assertEqual('Bearer %s' % json.loads(exchanges[0]['body'])['access_token'], exchanges[1]['authorization'])
+        self.assertEqual(self.recorder.redact('access token 2'), json.loads(exchanges[2]['body'])['access_token'])
+        self.assertEqual(self.recorder.redact('nested token'),
+                         json.loads(exchanges[3]['body'])['links'][0]['access_token'])
+        self.assertNotEqual(self.recorder.redact('the password'), RecordingAdapter().redact('the password'))
+
+    def test_body_recorded_as_read(self):
+        httpd = _ReuseAddressTcpServer('', server_port, TokenAndApiHandler)
+        threading.Thread(target=httpd.serve_forever).start()
+        try:
+            TokenAndApiHandler.GENERATION = 1
+            manager = CredentialManager(service_information, proxies=dict(http=''), transport=self.recorder)
+            manager.init_with_user_credentials('login', 'the password')
+            self.assertEqual(5, len(self.recorder.exchanges))
+            response = manager.get(api_url, stream=True)
+            self.assertEqual(5, len(self.recorder.exchanges))
+            self.assertEqual('resource', response.json()['value'])
+            self.assertEqual(6, len(self.recorder.exchanges))
+            self.assertEqual('resource', manager.get(api_url, deadline=5).json()['value'])
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+        self.assertEqual(7, len(self.recorder.exchanges))
+        for exchange in self.recorder.exchanges[5:]:
+            self.assertEqual(self.recorder.redact('nested token'),
+                             json.loads(exchange['body'])['links'][0]['access_token'])
+
+    def test_replay(self):
+        replay = ReplayAdapter.load(self.path, latency_scale=0)
+        for _ in range(3):
+            manager = CredentialManager(service_information, proxies=dict(http=''), transport=replay)
+            manager.init_with_user_credentials('login', 'another password')
+            self.assertEqual(self.recorder.redact('access token 1'), manager._access_token)
+            response = manager.get(api_url)
+            self.assertEqual(HTTPStatus.OK.value, response.status_code)
+            self.assertEqual('resource', response.json()['value'])
+            self.assertEqual(self.recorder.redact('access token 2'), manager._access_token)
+            self.assertEqual(self.recorder.redact('refresh token 2'), manager.refresh_token)
+
+    def test_replay_latency(self):
+        replay = ReplayAdapter.load(self.path, latency_scale=2)
+        manager = CredentialManager(service_information, proxies=dict(http=''), transport=replay)
+        manager._access_token = 'expired token'
+        start = time.monotonic()
+        self.assertEqual(HTTPStatus.UNAUTHORIZED.value, manager.get(api_url).status_code)
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertRaises(OAuthTimeoutError, manager.get, api_url, deadline=0.05)
+
+    def test_replay_unknown_exchange(self):
+        replay = ReplayAdapter.load(self.path, latency_scale=0, loop=False)
+        manager = CredentialManager(service_information, proxies=dict(http=''), transport=replay)
+        manager._access_token = 'a token'
+        self.assertRaises(requests.exceptions.ConnectionError, manager.get, '%s/other' % api_url)
+        manager.get(api_url)
+        manager.get(api_url)
+        self.assertRaises(requests.exceptions.ConnectionError, manager.get, api_url)
+
+    def test_replay_ignores_secret_parameters(self):
+        replay = ReplayAdapter([dict(method='GET', url='%s?page=1&code=%s' % (api_url, self.recorder.redact('abc')),
+                                     status=200, body='ok')], latency_scale=0)
+        manager = CredentialManager(service_information, proxies=dict(http=''), transport=replay)
+        manager._access_token = 'a token'
+        self.assertEqual('ok', manager.get(api_url, params=dict(page='1', code='another code')).text)
+        self.assertRaises(requests.exceptions.ConnectionError, manager.get, api_url, params=dict(page='2'))